@@ -1,10 +1,18 @@
 import os
+import functools
+import hashlib
 import subprocess
 import json
 import re
+import shlex
+import shutil
 import sys
+import tempfile
+import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from google import genai
+from google.genai import types
 
 
 SRC_DIR = "src/main/java"
@@ -13,44 +21,242 @@ BASE_BRANCH = os.getenv("BASE_BRANCH", "main")
 GITHUB_REF_NAME = os.getenv("GITHUB_REF_NAME")
 GITHUB_HEAD_REF = os.getenv("GITHUB_HEAD_REF")
 GITHUB_RUN_ID = os.getenv("GITHUB_RUN_ID", "local")
+SUREFIRE_REPORTS_DIR = "target/surefire-reports"
+LLM_CACHE_DIR = os.getenv("LLM_CACHE_DIR", ".llm-cache") # restore via actions/cache to reuse across CI retries
 
 # --- Configuration ---
 CLIENT = genai.Client(api_key=GEMINI_API_KEY)
 MODEL_ID = "gemini-2.0-flash" # Optimized for speed/cost in CI
+GEN_CONCURRENCY = int(os.getenv("GEN_CONCURRENCY", "8")) # parallel Gemini requests, keep within quota
+
+# Read once at import: os.umask() can only be queried by setting it, which is not thread-safe
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
+# Java identifier tokens used to build the dependents index
+TOKEN_RE = re.compile(r'\b[A-Za-z_][A-Za-z0-9_]*\b')
+
+# Unified diff parsing: new-side file header (post-rename path) and the '+start,count' of each hunk
+DIFF_HEADER_RE = re.compile(r"^\+\+\+ b/(.*)$")
+HUNK_RE = re.compile(r"^@@ -\d+(?:,\d+)? \+(\d+)(?:,(\d+))?", re.MULTILINE)
+
+# Top-level type declaration kept when the prompt source is sliced down to the diff hunks
+CLASS_DECL_RE = re.compile(r"^\s*(?:(?:public|protected|private|abstract|final|static)\s+)*(?:class|interface|enum|record)\s+\w+")
+HUNK_CONTEXT_LINES = 20
+
+# Above this many characters the -Dtest= list is collapsed to per-package patterns (avoids E2BIG)
+MAX_TEST_FILTER_CHARS = 30000
+
+# The Surefire summary is printed at the very end; scan this tail of the output first
+RESULTS_TAIL_CHARS = 16384
+
+# Maven Surefire summary lines
+RESULTS_RE = re.compile(r"Results\s*:\s*\n+(Tests run: (\d+), Failures: (\d+), Errors: (\d+), Skipped: (\d+))", re.IGNORECASE)
+TESTS_RUN_RE = re.compile(r"Tests run: (\d+), Failures: (\d+), Errors: (\d+), Skipped: (\d+)")
+
+# Spring stereotype annotations sit near the class declaration, so only the file head is scanned
+ANNOT_RE = re.compile(rb'@(RestController|Controller|Service|Repository|Entity)\b')
+ANNOT_HEAD_BYTES = 8192
+# Checked in priority order when a class carries more than one annotation
+ANNOT_TYPES = {
+    b"RestController": "CONTROLLER",
+    b"Controller": "CONTROLLER",
+    b"Service": "SERVICE",
+    b"Repository": "REPOSITORY",
+    b"Entity": "ENTITY",
+}
+
+def _sh(argv, capture=True, check=False):
+    # argv lists run without an intermediate /bin/sh and need no shell quoting
+    return subprocess.run(argv, capture_output=capture, text=True, check=check)
+
+def list_java_sources(src_dir):
+    """Lists .java files under src_dir from git's index (plus untracked, non-ignored files).
+    Falls back to an os.scandir walk outside a git checkout."""
+    result = _sh(["git", "ls-files", "-z", "--cached", "--others", "--exclude-standard", "--", f":(glob){src_dir}/**/*.java"])
+    if result.returncode == 0:
+        # -z: NUL-terminated and unquoted, so non-ASCII paths come back verbatim
+        return [Path(p) for p in result.stdout.split("\0") if p]
+
+    files = []
+    stack = [src_dir]
+    while stack:
+        try:
+            entries = os.scandir(stack.pop())
+        except OSError:
+            continue
+        with entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif entry.name.endswith(".java"):
+                    files.append(Path(entry.path))
+    return files
+
+class FenceFilter:
+    """Writes streamed LLM text through, dropping ```java / ``` fences and surrounding whitespace."""
+    FENCE = "```java"
+
+    def __init__(self, write):
+        self.write = write
+        self.buf = ""
+        self.started = False
+        self.pending_ws = ""
+
+    def _emit(self, text):
+        # Equivalent of .strip() on the full output: skip leading and hold back trailing whitespace
+        if not self.started:
+            text = text.lstrip()
+            if not text:
+                return
+            self.started = True
+        body = text.rstrip()
+        if body:
+            self.write(self.pending_ws + body)
+            self.pending_ws = text[len(body):]
+        else:
+            self.pending_ws += text
+
+    def feed(self, text):
+        self.buf += text
+        while self.buf:
+            i = self.buf.find("`")
+            if i == -1:
+                self._emit(self.buf)
+                self.buf = ""
+                return
+            self._emit(self.buf[:i])
+            self.buf = self.buf[i:]
+            if self.buf.startswith(self.FENCE):
+                self.buf = self.buf[len(self.FENCE):]
+            elif self.FENCE.startswith(self.buf):
+                return  # partial fence, wait for the next chunk
+            elif self.buf.startswith("```"):
+                self.buf = self.buf[3:]
+            else:
+                self._emit(self.buf[0])
+                self.buf = self.buf[1:]
+
+    def close(self):
+        if self.buf.startswith("```"):
+            self.buf = self.buf[3:]
+        self._emit(self.buf)
+        self.buf = ""
+
+def stream_generate(prompt, write):
+    """Streams a Gemini response into write(), filtering code fences on the fly.
+    Responses are cached on a hash of the model and prompt so identical reruns skip the API call;
+    empty or truncated replies are not cached."""
+    key = hashlib.blake2b(f"{MODEL_ID}\0{prompt}".encode(), digest_size=16).hexdigest()
+    cache = Path(LLM_CACHE_DIR) / f"{key}.txt"
+    if cache.exists():
+        write(cache.read_text())
+        return
+
+    parts = []
+    def tee(text):
+        parts.append(text)
+        write(text)
+
+    fence = FenceFilter(tee)
+    finish_reason = None
+    for chunk in CLIENT.models.generate_content_stream(model=MODEL_ID, contents=prompt):
+        if chunk.text:
+            fence.feed(chunk.text)
+        if chunk.candidates and chunk.candidates[0].finish_reason:
+            finish_reason = chunk.candidates[0].finish_reason
+    fence.close()
+
+    if parts and finish_reason == types.FinishReason.STOP:
+        cache.parent.mkdir(parents=True, exist_ok=True)
+        cache.write_text("".join(parts))
+
+def stream_generate_to_file(prompt, target_path):
+    """Streams a Gemini response into a temp file beside target_path and swaps it in on success,
+    so a failed or interrupted call never leaves an empty or half-written test behind."""
+    target_path = Path(target_path)
+    tmp = tempfile.NamedTemporaryFile("w", dir=target_path.parent, suffix=".tmp", delete=False)
+    try:
+        with tmp:
+            stream_generate(prompt, tmp.write)
+        # NamedTemporaryFile is created 0600; keep the target's mode, or the umask default for new files
+        if target_path.exists():
+            shutil.copymode(target_path, tmp.name)
+        else:
+            os.chmod(tmp.name, 0o666 & ~_UMASK)
+        os.replace(tmp.name, target_path)
+    except BaseException:
+        os.unlink(tmp.name)
+        raise
+
+@functools.lru_cache(maxsize=4096)
+def _classify_cached(file_path, mtime):
+    # mtime is part of the cache key so an edited file is re-classified
+    with open(file_path, 'rb') as f:
+        head = f.read(ANNOT_HEAD_BYTES)
+
+    found = set(ANNOT_RE.findall(head))
+    for annotation, comp_type in ANNOT_TYPES.items():
+        if annotation in found: return comp_type
+    if "DTO" in file_path or "Dto" in file_path: return "DTO"
+    return "JAVA_COMPONENT" # Default
 
 class TestAutomationAgent:
     
     def __init__(self):
-        self.all_source_files = list(Path(SRC_DIR).rglob("*.java"))
-
-    def run_cmd(self, cmd):
+        self.all_source_files = list_java_sources(SRC_DIR)
+        self._token_index: dict[str, set[str]] = {}
+        self._file_tokens_cached = False
+
+    def run_cmd(self, argv):
+        # Prefer the Maven daemon so heal retries reuse a warm JVM
+        if argv[0] == "./mvnw" and shutil.which("mvnd"):
+            argv = ["mvnd"] + argv[1:]
         # If the command starts with ./mvnw, check if it exists
-        if cmd.startswith("./mvnw") and not os.path.exists("mvnw"):
+        elif argv[0] == "./mvnw" and not os.path.exists("mvnw"):
             print("⚠️ Maven Wrapper not found. Falling back to global 'mvn'...")
-            cmd = cmd.replace("./mvnw", "mvn")
+            argv = ["mvn"] + argv[1:]
             
-        result = subprocess.run(cmd, shell=True, capture_output=True, text=True)
+        result = _sh(argv)
         return result.stdout.strip() + "\n" + result.stderr.strip(), result.returncode
 
-    def run_git_command(self, command):
-        result = subprocess.run(command, shell=True, capture_output=True, text=True)
+    def run_git_command(self, argv):
+        result = _sh(argv)
         return result.stdout.strip() if result.returncode == 0 else ""
 
+    def _collect_all_hunks(self):
+        """Runs a single -U0 diff and buckets the 'start,count' of every hunk by file path.
+        Files are keyed on their new path so renamed sources line up with `git diff --name-only`."""
+        diff_output = self.run_git_command(["git", "diff", "-U0", f"origin/{BASE_BRANCH}...HEAD", "--", "*.java"])
+        out = {}
+        current = None
+        in_header = False
+        for line in diff_output.splitlines():
+            if line.startswith("diff --git "):
+                current, in_header = None, True
+                continue
+            # Only look for '+++' before the first hunk, where it cannot be an added line
+            header = DIFF_HEADER_RE.match(line) if in_header else None
+            if header:
+                current = header.group(1)
+                out.setdefault(current, [])
+                continue
+            hunk = HUNK_RE.match(line)
+            if hunk:
+                in_header = False
+                if current is not None:
+                    # An omitted count means a single line
+                    out[current].append(f"{hunk.group(1)},{hunk.group(2) or 1}")
+        return out
+
     def get_class_name(self, file_path):
         basename = os.path.basename(file_path)
         return os.path.splitext(basename)[0]
 
     def identify_component_type(self, file_path):
+        file_path = str(file_path)
         if not os.path.exists(file_path): return "DELETED"
-        with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
-            content = f.read()
-        
-        if "@RestController" in content or "@Controller" in content: return "CONTROLLER"
-        if "@Service" in content: return "SERVICE"
-        if "@Repository" in content: return "REPOSITORY"
-        if "@Entity" in content: return "ENTITY"
-        if "DTO" in file_path or "Dto" in file_path: return "DTO"
-        return "JAVA_COMPONENT" # Default
+        return _classify_cached(file_path, os.path.getmtime(file_path))
 
     # def find_dependents(self, target_class_name, all_java_files):
     #     """
@@ -71,15 +277,22 @@ class TestAutomationAgent:
                 
     #     return dependents
 
+    def _build_token_index(self):
+        """Reads every source file once and maps each identifier token to the files using it."""
+        for path in self.all_source_files:
+            try:
+                text = path.read_text(errors='ignore')
+            except OSError:
+                continue # tracked but deleted in the working tree
+            for tok in set(TOKEN_RE.findall(text)):
+                self._token_index.setdefault(tok, set()).add(str(path))
+        self._file_tokens_cached = True
+
     def find_dependents(self, class_name, original_path):
-        dependents = []
-        pattern = re.compile(r'\b' + re.escape(class_name) + r'\b')
-        for f in self.all_source_files:
-            if class_name in os.path.basename(str(f)):
-                continue
-            if str(f) != str(original_path) and pattern.search(f.read_text(errors='ignore')):
-                dependents.append(str(f))
-        return dependents
+        if not self._file_tokens_cached:
+            self._build_token_index()
+        return sorted(p for p in self._token_index.get(class_name, ())
+                      if p != str(original_path) and class_name not in os.path.basename(p))
 
 
 
@@ -122,8 +335,8 @@ class TestAutomationAgent:
 
     def get_test_path(self, source_path):
         """Converts src/main/java/.../Name.java to src/test/java/.../NameTest.java"""
-        test_path = source_path.replace("src/main/java", "src/test/java")
-        return test_path.replace(".java", "Test.java")
+        test_path = source_path.replace("src/main/java", "src/test/java", 1)
+        return test_path[:-len(".java")] + "Test.java" if test_path.endswith(".java") else test_path
 
 
     def generate_test_plan(self, impact_manifest):
@@ -140,12 +353,12 @@ class TestAutomationAgent:
             dependents = cluster["ripple_effect"]
             
             # Add source file to test plan
-            all_targets = [(source["path"], source["type"], "DIRECT")]
+            all_targets = [(source["path"], source["type"], "DIRECT", source.get("line_ranges", []))]
             # Add ripple files to test plan
             for dep in dependents:
-                all_targets.append((dep["path"], dep["type"], "RIPPLE"))
+                all_targets.append((dep["path"], dep["type"], "RIPPLE", []))
 
-            for path, comp_type, impact_kind in all_targets:
+            for path, comp_type, impact_kind, line_ranges in all_targets:
                 if path in seen_files:
                     continue
                 
@@ -163,6 +376,7 @@ class TestAutomationAgent:
                     "frameworks": strategy["frameworks"],
                     "target_test_file": test_file,
                     "action": action,
+                    "line_ranges": line_ranges,
                     "coverage_goal": "High" if impact_kind == "DIRECT" else "Regression"
                 })
                 seen_files.add(path)
@@ -173,9 +387,46 @@ class TestAutomationAgent:
 
 
 #### Test Generation (LLM assisted) starts here ######
+    def _slice_hunks(self, text, line_ranges, context=HUNK_CONTEXT_LINES):
+        """Keeps the class declaration plus a +/-context window around each changed hunk."""
+        if not line_ranges:
+            return text
+        lines = text.splitlines()
+
+        # 'start,count' hunks (1-based) -> 0-based [lo, hi) slices
+        spans = []
+        for r in line_ranges:
+            start, _, count = r.partition(",")
+            start, count = int(start), int(count or 1)
+            lo, hi = max(start - 1 - context, 0), min(start - 1 + count + context, len(lines))
+            if lo < hi:
+                spans.append((lo, hi))
+        if not spans:
+            return text
+
+        # The declaration is a one-line span, so it is emitted once and in source order
+        decl = next((i for i, line in enumerate(lines) if CLASS_DECL_RE.match(line)), None)
+        if decl is not None:
+            spans.append((decl, decl + 1))
+
+        # Merge overlapping windows
+        windows = []
+        for lo, hi in sorted(spans):
+            if windows and lo <= windows[-1][1]:
+                windows[-1][1] = max(windows[-1][1], hi)
+            else:
+                windows.append([lo, hi])
+        return "\n// ... elided ...\n".join("\n".join(lines[lo:hi]) for lo, hi in windows)
+
     def synthesize_and_save(self, entry):
             source_code = Path(entry['source_path']).read_text()
-            existing_test_code = open(entry['target_test_file'], 'r', encoding='utf-8').read() if entry['action'] == 'EXTEND' and os.path.exists(entry['target_test_file']) else ''
+            if entry['action'] == 'EXTEND':
+                # Existing tests only need the changed code, not the whole class
+                source_code = self._slice_hunks(source_code, entry.get('line_ranges', []))
+            target_path = Path(entry['target_test_file'])
+            # Read the existing test once; it is reused for the prompt and the append merge
+            existing_bytes = target_path.read_bytes() if entry['action'] == 'EXTEND' and target_path.exists() else b''
+            existing_test_code = existing_bytes.decode('utf-8')
             newline = '\n'
             
             prompt = f"""
@@ -208,40 +459,46 @@ class TestAutomationAgent:
             4. Ensure declared constructor in a class cannot be applied to given types
             """
 
-            response = CLIENT.models.generate_content(
-                model=MODEL_ID,
-                contents=prompt
-            )
-            code = response.text.replace("```java", "").replace("```", "").strip()
-            
-            target_path = Path(entry['target_test_file'])
             target_path.parent.mkdir(parents=True, exist_ok=True)
             
             if entry['action'] == "CREATE":
-                target_path.write_text(code)
+                # New class: write tokens to disk as they arrive
+                stream_generate_to_file(prompt, target_path)
             else:
-                current = target_path.read_text()
+                parts = []
+                stream_generate(prompt, parts.append)
+                code = "".join(parts)
                 # Basic append logic before final class brace
-                updated = current.rstrip().rstrip('}') + "\n\n    // Generated Tests\n" + code + "\n}"
+                updated = existing_test_code.rstrip().rstrip('}') + "\n\n    // Generated Tests\n" + code + "\n}"
                 target_path.write_text(updated)
 
+    def run_concurrently(self, fn, entries, *args):
+        """Runs fn(entry, *args) for every entry on a thread pool; Gemini calls are network-bound."""
+        with ThreadPoolExecutor(max_workers=GEN_CONCURRENCY) as ex:
+            return list(ex.map(lambda e: fn(e, *args), entries))
+
 #### Test Generation (LLM assisted) ends here ######
 
 
 #### Test Execution starts here ######
+    def get_test_classes(self, test_plan):
+        """Converts test file paths to class names for Maven (e.g., src/test/java/com/pkg/AppTest.java -> com.pkg.AppTest)"""
+        return sorted({
+            entry["target_test_file"].replace("src/test/java/", "").replace(".java", "").replace("/", ".")
+            for entry in test_plan["test_entries"]
+        })
+
     def run_selective_tests(self, test_plan):
         """Runs only the newly generated/modified tests."""
-        # Convert file paths to class names for Maven (e.g., src/test/java/com/pkg/AppTest.java -> com.pkg.AppTest)
-        test_classes = []
-        for entry in test_plan["test_entries"]:
-            path = entry["target_test_file"]
-            class_name = path.replace("src/test/java/", "").replace(".java", "").replace("/", ".")
-            test_classes.append(class_name)
+        test_classes = self.get_test_classes(test_plan)
         
         test_filter = ",".join(test_classes)
+        if len(test_filter) > MAX_TEST_FILTER_CHARS:
+            packages = sorted({c.rpartition(".")[0] for c in test_classes})
+            test_filter = ",".join(f"{pkg.replace('.', '/')}/*Test" for pkg in packages)
         # Use -DfailIfNoTests=false to avoid crashing if mapping fails
         print(f"👟 Running generated tests: {test_filter}")
-        output, code = self.run_cmd(f"./mvnw test -Dtest={test_filter} -DfailIfNoTests=false")
+        output, code = self.run_cmd(["./mvnw", "test", f"-Dtest={test_filter}", "-DfailIfNoTests=false"])
         return code, output
     
     def self_heal(self, entry, error_log):
@@ -258,12 +515,17 @@ class TestAutomationAgent:
         RULES: Return ONLY the corrected Java code.
         """
         
-        response = CLIENT.models.generate_content(
-                model=MODEL_ID,
-                contents=prompt
-        )
-        new_code = response.text.replace("```java", "").replace("```", "").strip()
-        Path(entry['target_test_file']).write_text(new_code)
+        stream_generate_to_file(prompt, entry['target_test_file'])
+
+    def push_branch(self, new_branch, check=False):
+        """Checks out, commits and force-pushes the generated tests in a single shell."""
+        script = " && ".join([
+            f"git checkout -b {shlex.quote(new_branch)}",
+            "git add src/test/java/ impact.json test-plan.json",
+            "git commit -m 'docs: AI-generated test suite and impact analysis'",
+            f"git push origin {shlex.quote(new_branch)} --force",
+        ])
+        return _sh(["sh", "-c", script], capture=False, check=check)
 
     def promote_to_pr(self, test_plan, summary):
 
@@ -278,15 +540,18 @@ class TestAutomationAgent:
         orig_pr_id = GITHUB_REF_NAME.split("/")[0]
         new_branch = f"ai-test-suite-{orig_pr_id}"
         
-        # Git Operations
-        subprocess.run(f"git checkout -b {new_branch}", shell=True)
-        subprocess.run("git add src/test/java/ impact.json test-plan.json", shell=True)
-        subprocess.run('git commit -m "docs: AI-generated test suite and impact analysis"', shell=True)
-        subprocess.run(f"git push origin {new_branch} --force", shell=True)
+        # Git Operations (raises so a failed push does not open a PR)
+        self.push_branch(new_branch, check=True)
 
         # PR Creation via 'gh' CLI
         pr_body = f"### AI Generated Test Suite\n{summary}\n\nRelated to PR #{orig_pr_id}"
-        subprocess.run(f'gh pr create --title "[PR-Aware] Test Validation for PR #{orig_pr_id}" --body "{pr_body}" --base main --head {new_branch}', shell=True)
+        _sh([
+            "gh", "pr", "create",
+            "--title", f"[PR-Aware] Test Validation for PR #{orig_pr_id}",
+            "--body", pr_body,
+            "--base", "main",
+            "--head", new_branch,
+        ], capture=False)
 
     def create_error_branch(self):
 
@@ -302,10 +567,7 @@ class TestAutomationAgent:
         new_branch = f"ai-test-suite-error{orig_pr_id}"
         
         # Git Operations
-        subprocess.run(f"git checkout -b {new_branch}", shell=True)
-        subprocess.run("git add src/test/java/ impact.json test-plan.json", shell=True)
-        subprocess.run('git commit -m "docs: AI-generated test suite and impact analysis"', shell=True)
-        subprocess.run(f"git push origin {new_branch} --force", shell=True)
+        self.push_branch(new_branch)
 
     # def parse_test_results(self, stdout):
     #     """
@@ -342,9 +604,9 @@ class TestAutomationAgent:
         # 1. Find 'Results:' (case-insensitive)
         # 2. Skip whitespace/newlines
         # 3. Capture the 'Tests run' line that follows
-        pattern = r"Results\s*:\s*\n+(Tests run: (\d+), Failures: (\d+), Errors: (\d+), Skipped: (\d+))"
-        
-        match = re.search(pattern, stdout, re.IGNORECASE)
+        # Only the tail is scanned unless it has no summary at all
+        tail = stdout[-RESULTS_TAIL_CHARS:]
+        match = RESULTS_RE.search(tail) or RESULTS_RE.search(stdout)
         
         if match:
             # group(1) is the full text line, groups 2-5 are the digits
@@ -361,7 +623,7 @@ class TestAutomationAgent:
             )
         
         # Fallback: If 'Results:' header is missing, grab the very last 'Tests run' line found
-        all_summaries = re.findall(r"Tests run: (\d+), Failures: (\d+), Errors: (\d+), Skipped: (\d+)", stdout)
+        all_summaries = TESTS_RUN_RE.findall(tail) or TESTS_RUN_RE.findall(stdout)
         if all_summaries:
             runs, fails, errs, skips = all_summaries[-1]
             status = "✅ PASS" if int(fails) == 0 and int(errs) == 0 else "❌ FAIL"
@@ -375,51 +637,89 @@ class TestAutomationAgent:
 
         return "✅ All generated tests passed after validation."
 
+    def _parse_surefire(self, test_classes):
+        """
+        Builds the test summary from Surefire's TEST-<class>.xml reports.
+        Returns None when no report exists, or one cannot be read, so the caller can fall back
+        to the console output.
+        """
+        totals = {"tests": 0, "failures": 0, "errors": 0, "skipped": 0}
+        found = False
+        for test_class in test_classes:
+            report = Path(SUREFIRE_REPORTS_DIR) / f"TEST-{test_class}.xml"
+            if not report.exists():
+                continue
+            # Only the root <testsuite> attributes are needed; stop at the first start event
+            try:
+                for _, elem in ET.iterparse(report, events=("start",)):
+                    for key in totals:
+                        totals[key] += int(elem.get(key, 0))
+                    break
+            except (ET.ParseError, ValueError, OSError) as e:
+                # A truncated or malformed report would undercount; use the console summary instead
+                print(f"⚠️ Unreadable Surefire report {report}: {e}")
+                return None
+            found = True
+
+        if not found:
+            return None
+
+        status = "✅ PASS" if totals["failures"] == 0 and totals["errors"] == 0 else "❌ FAIL"
+        return (
+            f"### Test Execution Summary {status}\n"
+            f"- **Total Tests**: {totals['tests']} (Aggregate)\n"
+            f"- **Failures**: {totals['failures']}\n"
+            f"- **Errors**: {totals['errors']}\n"
+            f"- **Skipped**: {totals['skipped']}\n"
+        )
+
 #### Test Execution ends here ######
 
     def execute(self):
 
+        # Line ranges for every changed file, collected with one git call
+        self._hunk_map = self._collect_all_hunks()
+
         # 1. Get Changed Files
-        diff_cmd = f"git diff --name-only origin/{BASE_BRANCH}...HEAD"
+        diff_cmd = ["git", "diff", "--name-only", f"origin/{BASE_BRANCH}...HEAD"]
         raw_changes = self.run_git_command(diff_cmd).split('\n')
         changed_files = [f for f in raw_changes if f.endswith(".java")]
 
-        # 2. Map all existing Java files for scanning
-        all_java_files = []
-        for root, _, files in os.walk(SRC_DIR):
-            for file in files:
-                if file.endswith(".java"):
-                    all_java_files.append(os.path.join(root, file))
+        # 2. Existing Java files were already collected into self.all_source_files
 
         manifest = {
             "summary": {"total_files_changed": len(changed_files), "risk_level": "LOW"},
             "impact_analysis": []
         }
 
+        # Classify every changed file once; reused for ripple entries below
+        changed_files_meta = {f: self.identify_component_type(f) for f in changed_files}
+
         # 3. Analyze each change individually
         for file_path in changed_files:
             # A. Metadata for the changed file
             class_name = self.get_class_name(file_path)
-            comp_type = self.identify_component_type(file_path)
+            comp_type = changed_files_meta[file_path]
             
             # Get line ranges
-            diff_hunk_cmd = f"git diff -U0 origin/{BASE_BRANCH}...HEAD -- {file_path}"
-            diff_output = self.run_git_command(diff_hunk_cmd)
-            ranges = [m.group(1) for m in re.finditer(r"^@@ -\d+.*? \+(\d+)", diff_output, re.MULTILINE)]
+            ranges = self._hunk_map.get(file_path, [])
             
             # B. Find Ripple Effects
-            dependents = self.find_dependents(class_name, all_java_files)
+            dependents = self.find_dependents(class_name, file_path)
             
             ripple_effects = []
             for dep in dependents:
                 dep_status = "IMPACTED"
                 # Check if this dependent is ALSO in the changed_files list
-                if dep in changed_files:
+                if dep in changed_files_meta:
                     dep_status = "ALSO_MODIFIED"
+                    dep_type = changed_files_meta[dep]
+                else:
+                    dep_type = self.identify_component_type(dep)
 
                 ripple_effects.append({
                     "path": dep,
-                    "type": self.identify_component_type(dep),
+                    "type": dep_type,
                     "reason": f"Imports/Uses {class_name}",
                     "status": dep_status
                 })
@@ -459,10 +759,8 @@ class TestAutomationAgent:
             json.dump(test_plan, f, indent=2)
         print("Completed creating test-plan.json")
 
-        # for entry in test_plan["test_entries"]:
-        #     print(f"🤖 Synthesizing {entry['test_type']} test for {entry['component_name']}...")
-        #     self.synthesize_and_save(entry)
-        #     print(f"🤖 Completed Synthesizing {entry['test_type']} test for {entry['component_name']}...")
+        # print(f"🤖 Synthesizing {len(test_plan['test_entries'])} tests...")
+        # self.run_concurrently(self.synthesize_and_save, test_plan["test_entries"])
 
         entry = test_plan["test_entries"][0]
         self.synthesize_and_save(entry)
@@ -483,14 +781,13 @@ class TestAutomationAgent:
             
                             # break
             print(f"❌ Test Failure (Attempt {attempt + 1}/{max_retries})")
-            for entry in test_plan["test_entries"]:
-                self.self_heal(entry, output)
+            self.run_concurrently(self.self_heal, test_plan["test_entries"], output)
             attempt += 1
 
         # 3. Finalization
         if success:
             try:
-                summary = self.parse_test_results(output)
+                summary = self._parse_surefire(self.get_test_classes(test_plan)) or self.parse_test_results(output)
                 self.promote_to_pr(test_plan, summary)
             except Exception as e:
                 print(f"Error in passing test results: {str(e)}")
@@ -1,12 +1,19 @@
 import os
 import re
+import shlex
+import shutil
 import sys
 import json
+import functools
+import hashlib
 import subprocess
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from fnmatch import fnmatch
 from pathlib import Path
-from typing import List, Optional
+from typing import Iterator, List, Optional, Tuple
 
 import boto3
+from botocore.config import Config
 
 
 # -----------------------------
@@ -22,6 +29,8 @@ MAX_FILES = int(os.getenv("MAX_FILES", "50"))  # safety cap
 START_AT = int(os.getenv("START_AT", "0"))     # resume support
 RUN_MAVEN = os.getenv("RUN_MAVEN", "false").lower() == "true"
 MAVEN_CMD = os.getenv("MAVEN_CMD", "./mvnw test -DfailIfNoTests=false")
+# Parallel Bedrock calls; GEN_CONCURRENCY is still honoured as the older name.
+BEDROCK_CONCURRENCY = int(os.getenv("BEDROCK_CONCURRENCY", os.getenv("GEN_CONCURRENCY", "8")))
 
 AWS_REGION = os.getenv("AWS_REGION", os.getenv("AWS_DEFAULT_REGION", "us-east-1"))
 
@@ -35,20 +44,94 @@ BEDROCK_MODEL_ID = os.getenv("BEDROCK_MODEL_ID", "").strip()
 MAX_TOKENS = int(os.getenv("MAX_TOKENS", "4000"))
 TEMPERATURE = float(os.getenv("TEMPERATURE", "0.2"))
 TOP_P = float(os.getenv("TOP_P", "0.9"))
+# Latency-optimized inference (lower TTFT for supported Claude models/regions).
+BEDROCK_LATENCY_OPT = os.getenv("BEDROCK_LATENCY_OPT", "true").lower() == "true"
+# Mark the invariant prompt prefix with a cachePoint so Bedrock reuses it across files.
+# Off by default: the built-in prefix (~190 tokens) is below the 1,024-token minimum
+# Claude models need for a cache checkpoint; enable it once the prefix is long enough.
+BEDROCK_PROMPT_CACHE = os.getenv("BEDROCK_PROMPT_CACHE", "false").lower() == "true"
+
+# Sources above this size are reduced to their public API surface before prompting.
+MAX_SOURCE_BYTES = int(os.getenv("MAX_SOURCE_BYTES", "40000"))
+# Generated sources (annotation processors, JPA metamodel) are skipped entirely.
+SKIP_SOURCE_GLOBS = ["*Generated*.java", "*_.java"]
 
 OUTPUT_MANIFEST = os.getenv("OUTPUT_MANIFEST", "generated-tests-manifest.json")
+# Response cache keyed by model, inference settings and prompt (component type + source);
+# a hit skips Bedrock entirely. Restore via actions/cache to reuse across CI retries.
+LLM_CACHE_DIR = os.getenv("LLM_CACHE_DIR", ".llm-cache")
+
+# Markdown code fences the model may wrap its answer in.
+FENCE_RE = re.compile(r"```(?:java)?")
+
+# Lines kept by extract_api_surface: package/imports, annotations, type declarations
+# and visible method/constructor signatures.
+API_SURFACE_RE = re.compile(
+    r"^\s*(?:package\s|import\s|@\w"
+    r"|(?:(?:public|protected|private|abstract|final|static)\s+)*(?:class|interface|enum|record)\s"
+    r"|(?:public|protected)\s+(?:static\s+)?(?:[\w<>,.?\[\]]+\s+)*\w+\s*\()"
+)
+
+# Spring stereotype annotations sit near the class declaration; only the file head is scanned.
+ANNOT_RE = re.compile(rb"@(RestController|Controller|Service|Repository|Entity)\b")
+ANNOT_HEAD_BYTES = 8192
+# Checked in priority order when a class carries more than one annotation.
+ANNOT_TYPES = {
+    b"RestController": "CONTROLLER",
+    b"Controller": "CONTROLLER",
+    b"Service": "SERVICE",
+    b"Repository": "REPOSITORY",
+    b"Entity": "ENTITY",
+}
 
 
 # -----------------------------
 # Helpers
 # -----------------------------
-def run(cmd: str, check: bool = True) -> subprocess.CompletedProcess:
-    return subprocess.run(cmd, shell=True, text=True, capture_output=True, check=check)
+def run(argv: List[str], check: bool = True) -> subprocess.CompletedProcess:
+    # argv lists run without an intermediate /bin/sh and need no shell quoting.
+    return subprocess.run(argv, text=True, capture_output=True, check=check)
+
+
+def iter_records(argv: List[str], sep: str = "\n") -> Iterator[str]:
+    # Yield sep-terminated records as the command writes them instead of buffering the whole output.
+    # Stopping iteration early terminates the child process.
+    p = subprocess.Popen(argv, text=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    finished = False
+    try:
+        pending = ""
+        for chunk in iter(lambda: p.stdout.read(65536), ""):
+            *records, pending = (pending + chunk).split(sep)
+            yield from records
+        if pending:
+            yield pending
+        finished = True
+    finally:
+        if not finished:
+            p.terminate()
+        stderr = p.stderr.read()
+        p.wait()
+        p.stdout.close()
+        p.stderr.close()
+    if p.returncode != 0:
+        raise subprocess.CalledProcessError(p.returncode, argv, stderr=stderr)
+
+
+def ensure_origin_base_fetched(base_branch: str) -> None:
+    # Fetch only the base branch; deepen shallow CI clones enough for a merge-base.
+    cmd = ["git", "fetch", "--no-tags"]
+    if run(["git", "rev-parse", "--is-shallow-repository"], check=False).stdout.strip() == "true":
+        cmd.append("--depth=50")
+    # stdout (ref updates) is discarded rather than buffered; stderr is kept for the warning.
+    subprocess.run(
+        cmd + ["origin", base_branch],
+        stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True, check=True,
+    )
 
 
 def git_root() -> Path:
     try:
-        cp = run("git rev-parse --show-toplevel", check=True)
+        cp = run(["git", "rev-parse", "--show-toplevel"], check=True)
         return Path(cp.stdout.strip())
     except subprocess.CalledProcessError:
         raise RuntimeError("Not inside a git repository. Run this inside your pr-ai-agent repo.")
@@ -72,127 +155,225 @@ def safe_read_text(p: Path, limit_chars: int = 200_000) -> str:
     return txt
 
 
+def is_generated_source(java_file: Path) -> bool:
+    return any(fnmatch(java_file.name, pattern) for pattern in SKIP_SOURCE_GLOBS)
+
+
+def extract_api_surface(java_file: Path) -> str:
+    # Signatures only; bodies are dropped to keep the prompt small.
+    lines = [line.rstrip() for line in safe_read_text(java_file).splitlines() if API_SURFACE_RE.match(line)]
+    return "/* API SURFACE ONLY: method bodies omitted */\n" + "\n".join(lines) + "\n"
+
+
+def read_prompt_source(java_file: Path) -> str:
+    if java_file.stat().st_size > MAX_SOURCE_BYTES:
+        return extract_api_surface(java_file)
+    return safe_read_text(java_file)
+
+
 def java_to_test_path(source_path: str) -> str:
     # src/main/java/a/b/C.java -> src/test/java/a/b/CTest.java
-    test_path = source_path.replace(SRC_DIR, TEST_DIR)
-    return test_path.replace(".java", "Test.java")
+    # Only the first SRC_DIR and the trailing extension are rewritten.
+    test_path = source_path.replace(SRC_DIR, TEST_DIR, 1)
+    return test_path[:-len(".java")] + "Test.java" if test_path.endswith(".java") else test_path
+
+
+@functools.lru_cache(maxsize=4096)
+def _classify_cached(path: str, mtime: float) -> str:
+    # mtime is part of the key so an edited file is re-classified
+    with open(path, "rb") as fh:
+        head = fh.read(ANNOT_HEAD_BYTES)
+    found = set(ANNOT_RE.findall(head))
+    for annotation, comp_type in ANNOT_TYPES.items():
+        if annotation in found:
+            return comp_type
+    if "DTO" in path or "Dto" in path:
+        return "DTO"
+    return "JAVA_COMPONENT"
 
 
 def classify_component(java_file: Path) -> str:
-    txt = safe_read_text(java_file, limit_chars=80_000)
-    if "@RestController" in txt or "@Controller" in txt:
-        return "CONTROLLER"
-    if "@Service" in txt:
-        return "SERVICE"
-    if "@Repository" in txt:
-        return "REPOSITORY"
-    if "@Entity" in txt:
-        return "ENTITY"
-    if "DTO" in str(java_file) or "Dto" in str(java_file):
-        return "DTO"
-    return "JAVA_COMPONENT"
+    return _classify_cached(str(java_file), java_file.stat().st_mtime)
 
 
-def get_changed_java_files(base_branch: str) -> List[str]:
+def get_changed_java_files(base_branch: str, limit: Optional[int] = None) -> List[str]:
     """
     Robust diff selection:
       - Try three-dot (merge-base) first
       - Fall back to two-dot
       - Fall back to last commit
+    The first range git can diff wins, even if it touches no Java sources; the next
+    one is only tried when git fails or the range has no changes at all.
+    Stops reading git output once `limit` files have been collected.
     """
-    candidates = [
-        f"git diff --name-only origin/{base_branch}...HEAD",
-        f"git diff --name-only {base_branch}...HEAD",
-        f"git diff --name-only origin/{base_branch}..HEAD",
-        f"git diff --name-only {base_branch}..HEAD",
-        "git diff --name-only HEAD~1..HEAD",
+    # Filtering is pushed into git: added/copied/modified/renamed Java sources only,
+    # NUL-separated so unusual file names survive.
+    diff = ["git", "diff", "--name-only", "-z", "--diff-filter=ACMR"]
+    pathspec = ["--", f":(glob){SRC_DIR}/**/*.java"]
+    ranges = [
+        f"origin/{base_branch}...HEAD",
+        f"{base_branch}...HEAD",
+        f"origin/{base_branch}..HEAD",
+        f"{base_branch}..HEAD",
+        "HEAD~1..HEAD",
     ]
 
-    out = ""
-    for cmd in candidates:
+    for rev in ranges:
+        cmd = diff + [rev] + pathspec
         try:
-            cp = run(cmd, check=True)
-            out = cp.stdout.strip()
-            if out:
-                break
+            java_files = []
+            records = iter_records(cmd, sep="\0")
+            try:
+                for f in records:
+                    if f:
+                        java_files.append(f)
+                    if limit is not None and len(java_files) >= limit:
+                        break
+            finally:
+                records.close()  # terminates git if we stopped early
         except subprocess.CalledProcessError as e:
             msg = (e.stderr or e.stdout or "").strip()
             last = msg.splitlines()[-1] if msg else "unknown git diff error"
-            print(f"Warning: diff failed: {cmd}")
+            print(f"Warning: diff failed: {' '.join(cmd)}")
             print(f"  {last}")
+            continue
+
+        # --quiet exits 1 when the range has changes; 0 (empty, e.g. HEAD is the base) tries the next one.
+        if java_files or run(["git", "diff", "--quiet", rev], check=False).returncode == 1:
+            return java_files
+
+    return []
 
-    if not out:
-        return []
 
-    return [f for f in out.splitlines() if f.endswith(".java")]
+# One session/config per process; the pool must be larger than BEDROCK_CONCURRENCY
+# or workers queue on connections.
+_SESSION = boto3.session.Session()
+_BEDROCK_CONFIG = Config(
+    max_pool_connections=max(32, BEDROCK_CONCURRENCY * 2),
+    tcp_keepalive=True,
+    retries={"mode": "adaptive", "max_attempts": 5},
+    read_timeout=120,
+    connect_timeout=10,
+)
 
 
 def bedrock_client():
-    return boto3.client("bedrock-runtime", region_name=AWS_REGION)
+    return _SESSION.client("bedrock-runtime", region_name=AWS_REGION, config=_BEDROCK_CONFIG)
 
 
-def bedrock_generate_text(client, prompt: str) -> str:
+def bedrock_generate_text(client, prefix: str, suffix: str) -> str:
     if not BEDROCK_MODEL_ID:
         raise RuntimeError(
             "BEDROCK_MODEL_ID is not set. For Claude Opus 4.6 you typically must set it to an "
             "Inference Profile ARN (not the raw model id)."
         )
 
-    resp = client.converse(
+    kwargs = {}
+    if BEDROCK_LATENCY_OPT:
+        kwargs["performanceConfig"] = {"latency": "optimized"}
+
+    # Everything that changes the reply is part of the key, not just the prompt.
+    settings = f"{BEDROCK_MODEL_ID}|{MAX_TOKENS}|{TEMPERATURE}|{TOP_P}|{kwargs.get('performanceConfig')}"
+    key = hashlib.blake2b(f"{settings}\0{prefix}\0{suffix}".encode("utf-8"), digest_size=16).hexdigest()
+    cache = Path(LLM_CACHE_DIR) / f"{key}.txt"
+    if cache.exists():
+        return cache.read_text(encoding="utf-8")
+
+    content = [{"text": prefix}]
+    if BEDROCK_PROMPT_CACHE:
+        content.append({"cachePoint": {"type": "default"}})
+    content.append({"text": suffix})
+
+    resp = client.converse_stream(
         modelId=BEDROCK_MODEL_ID,
-        messages=[{"role": "user", "content": [{"text": prompt}]}],
+        messages=[{"role": "user", "content": content}],
         inferenceConfig={
             "maxTokens": MAX_TOKENS,
             "temperature": TEMPERATURE,
             "topP": TOP_P,
         },
+        **kwargs,
     )
 
-    blocks = resp.get("output", {}).get("message", {}).get("content", [])
+    # Consume deltas as they arrive instead of waiting for the full response.
     parts = []
-    for b in blocks:
-        if "text" in b:
-            parts.append(b["text"])
-    return "\n".join(parts).strip()
-
-
-def build_prompt(component_type: str, source_code: str, target_test_file: str) -> str:
-    # Avoid triple-backticks inside triple-quotes; keep prompt construction simple.
-    rules = [
-        "Return ONLY Java code (no markdown, no explanations).",
-        "Include correct package declaration matching the target path.",
-        "Include all necessary imports.",
-        "Use JUnit 5. Use Mockito where needed.",
-        "Prefer deterministic tests; avoid flaky timing.",
-        "If Spring controller: use MockMvc and cover status + payload validations.",
-        "If service: mock dependencies and cover edge cases.",
-        "If repository/entity: prefer @DataJpaTest patterns (if feasible) or focus on mapping/validation.",
-    ]
-
-    prompt = (
+    stop_reason = None
+    for event in resp["stream"]:
+        if "contentBlockDelta" in event:
+            parts.append(event["contentBlockDelta"]["delta"].get("text", ""))
+        elif "contentBlockStop" in event:
+            parts.append("\n")
+        elif "messageStop" in event:
+            stop_reason = event["messageStop"].get("stopReason")
+    text = "".join(parts).strip()
+
+    # max_tokens / guardrail stops and empty replies are returned but never cached.
+    if text and stop_reason == "end_turn":
+        cache.parent.mkdir(parents=True, exist_ok=True)
+        cache.write_text(text, encoding="utf-8")
+    return text
+
+
+# Avoid triple-backticks inside triple-quotes; keep prompt construction simple.
+RULES = [
+    "Return ONLY Java code (no markdown, no explanations).",
+    "Include correct package declaration matching the target path.",
+    "Include all necessary imports.",
+    "Use JUnit 5. Use Mockito where needed.",
+    "Prefer deterministic tests; avoid flaky timing.",
+    "If Spring controller: use MockMvc and cover status + payload validations.",
+    "If service: mock dependencies and cover edge cases.",
+    "If repository/entity: prefer @DataJpaTest patterns (if feasible) or focus on mapping/validation.",
+]
+
+
+@functools.lru_cache(maxsize=None)
+def build_prompt_prefix(component_type: str) -> str:
+    # Identical for every file of the same component type, so it can be prompt-cached.
+    return (
         "You are a Senior Java Test Automation Engineer.\n\n"
         f"Goal: Generate a high-quality JUnit 5 test for this Java component.\n"
-        f"Component Type: {component_type}\n"
-        f"Target Test File Path: {target_test_file}\n\n"
+        f"Component Type: {component_type}\n\n"
         "RULES:\n"
-        + "\n".join([f"- {r}" for r in rules])
-        + "\n\n"
+        + "\n".join([f"- {r}" for r in RULES])
+        + "\n"
+    )
+
+
+def build_prompt(component_type: str, source_code: str, target_test_file: str) -> Tuple[str, str]:
+    # Returns (prefix, suffix); only the suffix varies per file.
+    suffix = (
+        f"Target Test File Path: {target_test_file}\n"
         "SOURCE CODE START\n"
         + source_code
         + "\nSOURCE CODE END\n"
     )
-    return prompt
+    return build_prompt_prefix(component_type), suffix
 
 
 def strip_code_fences(text: str) -> str:
-    # In case the model returns ```java ... ```
-    text = text.replace("```java", "").replace("```", "")
-    return text.strip()
+    # In case the model returns ```java ... ```; one pass for both fence forms.
+    return FENCE_RE.sub("", text).strip()
+
+
+def write_files(pairs: List[Tuple[Path, str]]) -> None:
+    # Batched at the end of the run; these are ephemeral CI artifacts, so no fsync.
+    def _write(pair: Tuple[Path, str]) -> None:
+        path, text = pair
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(text, encoding="utf-8")
+
+    with ThreadPoolExecutor(max_workers=16) as ex:
+        list(ex.map(_write, pairs))
 
 
 def ensure_mvnw_fallback(cmd: str) -> str:
-    if cmd.strip().startswith("./mvnw") and not Path("mvnw").exists():
-        return cmd.replace("./mvnw", "mvn", 1)
+    if cmd.strip().startswith("./mvnw"):
+        # Prefer the Maven daemon when installed; it keeps a warm JVM between builds.
+        if shutil.which("mvnd"):
+            return cmd.replace("./mvnw", "mvnd", 1)
+        if not Path("mvnw").exists():
+            return cmd.replace("./mvnw", "mvn", 1)
     return cmd
 
 
@@ -205,8 +386,7 @@ def main():
 
     # Refresh remote refs (best effort)
     try:
-        run("git fetch --all --prune", check=True)
-        run(f"git fetch origin {BASE_BRANCH} --prune", check=False)
+        ensure_origin_base_fetched(BASE_BRANCH)
     except subprocess.CalledProcessError as e:
         print("Warning: git fetch failed; continuing. This may affect diff mode.")
         print((e.stderr or e.stdout or "").strip())
@@ -216,7 +396,7 @@ def main():
         raise RuntimeError(f"SRC_DIR not found: {src_path}")
 
     if MODE == "diff":
-        java_files = get_changed_java_files(BASE_BRANCH)
+        java_files = get_changed_java_files(BASE_BRANCH, limit=START_AT + MAX_FILES)
         if not java_files:
             print("No changed Java files detected via diff. Exiting.")
             return
@@ -229,40 +409,68 @@ def main():
 
     client = bedrock_client()
 
-    generated = []
-    for i, f in enumerate(java_files, start=1):
+    jobs = []
+    results = {}
+    skipped = []
+    pending_writes: List[Tuple[Path, str]] = []
+    for i, f in enumerate(java_files):
         src_file = Path(f)
         if not src_file.exists():
             continue
+        if is_generated_source(src_file):
+            print(f"Skipping generated source: {src_file}")
+            skipped.append({"source": str(src_file), "reason": "generated source"})
+            continue
 
         comp_type = classify_component(src_file)
         tgt = java_to_test_path(str(src_file))
 
-        source_code = safe_read_text(src_file)
-        prompt = build_prompt(comp_type, source_code, tgt)
+        source_code = read_prompt_source(src_file)
+        jobs.append((i, src_file, tgt, comp_type, build_prompt(comp_type, source_code, tgt)))
+
+    def write_outputs() -> None:
+        write_files(pending_writes)
+        generated = [results[i] for i in sorted(results)]
+        Path(OUTPUT_MANIFEST).write_text(json.dumps({"generated": generated, "skipped": skipped}, indent=2), encoding="utf-8")
+        print(f"Wrote manifest: {OUTPUT_MANIFEST}")
 
-        print(f"[{i}/{len(java_files)}] Generating test for: {src_file} -> {tgt}")
+    # Bedrock calls are network-bound; boto3 clients are thread-safe for converse.
+    # Results are collected on this thread and test files written in one batch at the end
+    # together with the manifest (also on failure, so completed work is kept and listed);
+    # the manifest keeps input order.
+    try:
+        with ThreadPoolExecutor(max_workers=BEDROCK_CONCURRENCY) as ex:
+            futures = {ex.submit(bedrock_generate_text, client, *job[4]): job for job in jobs}
+            for done, fut in enumerate(as_completed(futures), start=1):
+                i, src_file, tgt, comp_type, _ = futures[fut]
+                try:
+                    out = fut.result()
+                except Exception as e:
+                    print(f"Bedrock call failed for {src_file}: {e}")
+                    ex.shutdown(wait=False, cancel_futures=True)
+                    raise
+
+                code = strip_code_fences(out)
+
+                target_path = Path(tgt)
+                pending_writes.append((target_path, code))
+                print(f"[{done}/{len(jobs)}] Generated test for: {src_file} -> {tgt}")
+
+                results[i] = {"source": str(src_file), "test": str(target_path), "type": comp_type}
+    except BaseException:
+        # Best effort only: a write error here must not mask the Bedrock failure being raised.
         try:
-            out = bedrock_generate_text(client, prompt)
+            write_outputs()
         except Exception as e:
-            print(f"Bedrock call failed for {src_file}: {e}")
-            raise
-
-        code = strip_code_fences(out)
-
-        target_path = Path(tgt)
-        target_path.parent.mkdir(parents=True, exist_ok=True)
-        target_path.write_text(code, encoding="utf-8")
-
-        generated.append({"source": str(src_file), "test": str(target_path), "type": comp_type})
+            print(f"Warning: could not write generated tests after failure: {e}")
+        raise
 
-    Path(OUTPUT_MANIFEST).write_text(json.dumps({"generated": generated}, indent=2), encoding="utf-8")
-    print(f"Wrote manifest: {OUTPUT_MANIFEST}")
+    write_outputs()
 
     if RUN_MAVEN:
         cmd = ensure_mvnw_fallback(MAVEN_CMD)
         print(f"Running Maven: {cmd}")
-        cp = run(cmd, check=False)
+        cp = run(shlex.split(cmd), check=False)
         print(cp.stdout)
         print(cp.stderr, file=sys.stderr)
         if cp.returncode != 0:
@@ -4,19 +4,47 @@
 
 import os
 import subprocess
-import json
 import re
 import sys
 import argparse
 from pathlib import Path
+from collections import defaultdict
 from dataclasses import dataclass
-from typing import List, Dict, Tuple
+from typing import List, Dict, Set, Tuple
 
 SRC_DIR = "src/main/java"
 BASE_BRANCH = os.getenv("BASE_BRANCH", "main")
 GITHUB_REF_NAME = os.getenv("GITHUB_REF_NAME", "")
 GITHUB_HEAD_REF = os.getenv("GITHUB_HEAD_REF", "")
 GITHUB_RUN_ID = os.getenv("GITHUB_RUN_ID", "local")
+TOKEN_RE = re.compile(r"\b[A-Za-z_][A-Za-z0-9_]*\b")
+FENCE_RE = re.compile(r"```(?:java)?")
+BEDROCK_LATENCY_OPT = os.getenv("BEDROCK_LATENCY_OPT", "true").lower() == "true"
+
+def list_java_sources(src_dir: str) -> List[Path]:
+    # git's index is much cheaper than stat-ing the tree; scandir walk outside a git checkout
+    result = subprocess.run(
+        ["git", "ls-files", "-z", "--cached", "--others", "--exclude-standard", "--", f":(glob){src_dir}/**/*.java"],
+        capture_output=True, text=True,
+    )
+    if result.returncode == 0:
+        # -z: NUL-terminated and unquoted, so non-ASCII paths come back verbatim
+        return [Path(p) for p in result.stdout.split("\0") if p]
+
+    files = []
+    stack = [src_dir]
+    while stack:
+        try:
+            entries = os.scandir(stack.pop())
+        except OSError:
+            continue
+        with entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif entry.name.endswith(".java"):
+                    files.append(Path(entry.path))
+    return files
 
 # ----------------------------
 # Prompt model
@@ -93,7 +121,15 @@ class Message:
 class BedrockClaudeLLM:
     def __init__(self, model: str, max_tokens: int):
         import boto3
-        self.client = boto3.client("bedrock-runtime")
+        from botocore.config import Config
+        config = Config(
+            max_pool_connections=32,
+            tcp_keepalive=True,
+            retries={"mode": "adaptive", "max_attempts": 5},
+            read_timeout=120,
+            connect_timeout=10,
+        )
+        self.client = boto3.session.Session().client("bedrock-runtime", config=config)
         self.model = model
         self.max_tokens = max_tokens
 
@@ -101,24 +137,23 @@ class BedrockClaudeLLM:
         system = "\n\n".join(m.content for m in messages if m.role == "system")
         user = "\n\n".join(m.content for m in messages if m.role == "user")
 
-        body = {
-            "anthropic_version": "bedrock-2023-05-31",
-            "max_tokens": self.max_tokens,
-            "system": system,
-            "messages": [{"role": "user", "content": user}],
-        }
+        kwargs = {}
+        if system:
+            kwargs["system"] = [{"text": system}]
+        if BEDROCK_LATENCY_OPT:
+            kwargs["performanceConfig"] = {"latency": "optimized"}
 
-        response = self.client.invoke_model(
+        response = self.client.converse(
             modelId=self.model,
-            body=json.dumps(body),
-            contentType="application/json",
-            accept="application/json",
+            messages=[{"role": "user", "content": [{"text": user}]}],
+            inferenceConfig={"maxTokens": self.max_tokens},
+            **kwargs,
         )
-        payload = json.loads(response["body"].read())
-        return payload["content"][0]["text"].strip()
+        blocks = response["output"]["message"]["content"]
+        return "".join(b.get("text", "") for b in blocks).strip()
 
 def strip_fences(t: str) -> str:
-    return t.replace("```java", "").replace("```", "").strip()
+    return FENCE_RE.sub("", t).strip()
 
 # ----------------------------
 # Main Agent
@@ -126,29 +161,38 @@ def strip_fences(t: str) -> str:
 class TestAutomationAgent:
     def __init__(self, llm):
         self.llm = llm
-        self.all_source_files = list(Path(SRC_DIR).rglob("*.java"))
+        self.all_source_files = list_java_sources(SRC_DIR)
+        self._index: Dict[str, Set[str]] = defaultdict(set)
+        self._index_built = False
 
-    def run_cmd(self, cmd: str):
-        result = subprocess.run(cmd, shell=True, capture_output=True, text=True)
+    def run_cmd(self, argv: List[str]):
+        result = subprocess.run(argv, capture_output=True, text=True)
         return (result.stdout + result.stderr).strip(), result.returncode
 
-    def find_dependents(self, class_name: str, original_path: str) -> List[str]:
-        dependents = []
-        pattern = re.compile(r"\b" + re.escape(class_name) + r"\b")
+    def _build_index(self):
+        # One pass over the sources: identifier token -> files containing it
         for f in self.all_source_files:
-            if str(f) == original_path:
-                continue
             try:
-                if pattern.search(f.read_text(errors="ignore")):
-                    dependents.append(str(f))
+                text = f.read_bytes().decode("utf-8", "ignore")
             except Exception:
-                pass
-        return dependents
+                continue
+            for tok in set(TOKEN_RE.findall(text)):
+                self._index[tok].add(str(f))
+        self._index_built = True
+
+    def find_dependents(self, class_name: str, original_path: str) -> List[str]:
+        if not self._index_built:
+            self._build_index()
+        return sorted(self._index.get(class_name, set()) - {original_path})
 
     def execute(self):
-        diff_cmd = f"git diff --name-only origin/{BASE_BRANCH}...HEAD"
-        changed = subprocess.check_output(diff_cmd, shell=True, text=True).splitlines()
-        java_files = [f for f in changed if f.endswith(".java")]
+        diff_cmd = ["git", "diff", "--name-only", f"origin/{BASE_BRANCH}...HEAD"]
+        # Filter paths as git writes them rather than buffering the whole listing
+        proc = subprocess.Popen(diff_cmd, stdout=subprocess.PIPE, text=True)
+        java_files = [line.rstrip("\n") for line in proc.stdout if line.rstrip("\n").endswith(".java")]
+        proc.stdout.close()
+        if proc.wait() != 0:
+            raise subprocess.CalledProcessError(proc.returncode, diff_cmd)
 
         if not java_files:
             print("No Java changes detected.")
@@ -156,7 +200,8 @@ class TestAutomationAgent:
 
         test_entries = []
         for src in java_files:
-            test_file = src.replace("src/main/java", "src/test/java").replace(".java", "Test.java")
+            test_file = src.replace("src/main/java", "src/test/java", 1)
+            test_file = test_file[:-len(".java")] + "Test.java"
             action = "EXTEND" if Path(test_file).exists() else "CREATE"
             test_entries.append({
                 "source_path": src,
@@ -181,10 +226,10 @@ class TestAutomationAgent:
             if entry["action"] == "CREATE":
                 Path(entry["target_test_file"]).write_text(code)
             else:
-                cur = Path(entry["target_test_file"]).read_text()
-                Path(entry["target_test_file"]).write_text(cur.rstrip("}") + "\n" + code + "\n}")
+                # Reuse the contents read for the prompt instead of re-reading the file
+                Path(entry["target_test_file"]).write_text(existing.rstrip("}") + "\n" + code + "\n}")
 
-        out, rc = self.run_cmd("./mvnw test -DfailIfNoTests=false")
+        out, rc = self.run_cmd(["./mvnw", "test", "-DfailIfNoTests=false"])
         print(out)
         if rc != 0:
             print("Tests failed")